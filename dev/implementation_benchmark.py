@@ -1,14 +1,14 @@
+import os
 import sys
 import time
 
 import compyute as cp
+import cupy
 import requests
 from compyute import nn
 from sdp import get_causal_mask
 from simple_tokenizers import CharacterTokenizer
 
-from transformer import Transformer
-
 
 def main() -> None:
     cp.random.set_seed(1337)
@@ -35,18 +35,9 @@ def main() -> None:
 
     # prepare data
     data_enc_t = cp.tensor(data_enc, dtype=cp.int32)
-    X_train = cp.stack(
-        [
-            data_enc_t[i * context_length : i * context_length + context_length]
-            for i in range(len(data_enc_t) // context_length)
-        ]
-    )
-    y_train = cp.stack(
-        [
-            data_enc_t[i * context_length + 1 : i * context_length + context_length + 1]
-            for i in range(len(data_enc_t) // context_length)
-        ]
-    )
+    n_seqs = (len(data_enc_t) - 1) // context_length  # targets are shifted by one
+    X_train = data_enc_t[: n_seqs * context_length].view((n_seqs, context_length))
+    y_train = data_enc_t[1 : n_seqs * context_length + 1].view((n_seqs, context_length))
 
     # create model
     mask = get_causal_mask(context_length)
@@ -55,7 +46,7 @@ def main() -> None:
         raise ValueError("Must provide implementation as argument.")
     implementation = sys.argv[1]
 
-    impl_options = ["parallel", "semiparallel", "sequential"]
+    impl_options = ["parallel", "semiparallel", "sequential", "sdp", "flash"]
     if implementation not in impl_options:
         impl_options_str = ", ".join(impl_options)
         raise ValueError(
@@ -63,16 +54,34 @@ def main() -> None:
         )
     print(f"Using {implementation} attenttion implementation.")
 
-    model = Transformer(
-        n_embeds=tokenizer.vocab_size,
-        embed_dim=embed_dims,
-        mlp_channels=4 * embed_dims,
-        n_heads=n_heads,
-        n_blocks=n_blocks,
-        max_context_len=context_length,
-        mask=mask,
-        implementation=implementation,
-    )
+    if implementation in ["sdp", "flash"]:
+        # final implementation, dev/transformer.py shadows the transformer package
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+        from transformer.gpt import GPTTransformer
+
+        model = GPTTransformer(
+            n_embeds=tokenizer.vocab_size,
+            embed_dim=embed_dims,
+            mlp_channels=4 * embed_dims,
+            n_heads=n_heads,
+            n_blocks=n_blocks,
+            max_context_len=context_length,
+            flash=implementation == "flash",
+            is_causal=True,
+        )
+    else:
+        from transformer import Transformer
+
+        model = Transformer(
+            n_embeds=tokenizer.vocab_size,
+            embed_dim=embed_dims,
+            mlp_channels=4 * embed_dims,
+            n_heads=n_heads,
+            n_blocks=n_blocks,
+            max_context_len=context_length,
+            mask=mask,
+            implementation=implementation,
+        )
     model.to_device(device)
 
     # training
@@ -82,8 +91,10 @@ def main() -> None:
 
     avg_dt = avg_tok_per_s = 0.0
 
+    # first steps include kernel compilation and memory pool growth
+    warmup_steps = 2
     steps = 20
-    for step in range(1, steps + 1):
+    for step in range(1 - warmup_steps, steps + 1):
         x, y = next(iter(train_dl()))
         start = time.perf_counter()
 
@@ -96,6 +107,8 @@ def main() -> None:
 
         cp.backend.synchronize()
         dt = time.perf_counter() - start
+        if step < 1:
+            continue
         tok_per_s = batch_size * context_length / dt
 
         avg_dt += dt
@@ -105,7 +118,9 @@ def main() -> None:
 
     avg_dt /= steps
     avg_tok_per_s /= steps
-    print(f"avg_dt {avg_dt:.4f} s | {avg_tok_per_s:.1f} avg tokens/s")
+    # the memory pool keeps freed blocks, so its size is the peak memory used
+    mem_gb = cupy.get_default_memory_pool().total_bytes() / 1e9
+    print(f"avg_dt {avg_dt:.4f} s | {avg_tok_per_s:.1f} avg tokens/s | {mem_gb:.2f} GB")
 
 
 if __name__ == "__main__":
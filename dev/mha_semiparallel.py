@@ -27,7 +27,7 @@ class SemiparallelMHA(Module):
         self.n_heads = n_heads
         self.mask = None if not mask else Buffer(mask)
         self.dropout = dropout
-        self.attn_w: list[Optional[Tensor]] = []
+        self.attn_w: list[Tensor] = []
 
         self.q_proj = Linear(in_channels, in_channels, bias, "QueryProj")
         self.k_proj = Linear(in_channels, in_channels, bias, "KeyProj")
@@ -40,6 +40,7 @@ class SemiparallelMHA(Module):
     def forward(self, x: Tensor) -> Tensor:
         dropout = self.dropout if self._is_training else 0
         attn_heads = []
+        self.attn_w = []  # only keep the weights of the latest call
 
         # input projection for self-attention
         q = self.q_proj(x)
@@ -63,7 +64,8 @@ class SemiparallelMHA(Module):
                 self._retain_values,
             )
             attn_heads.append(attn_head)
-            self.attn_w.append(attn_w_head)
+            if self._retain_values:
+                self.attn_w.append(attn_w_head)
         attn = concat(attn_heads)
 
         # output projection
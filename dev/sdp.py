@@ -65,7 +65,9 @@ class SDPAttentionFunction(Function):
 
         attn_weights = q @ k.T / math.sqrt(head_size)
         if mask is not None:
-            attn_weights += mask[:context_len, :context_len]
+            if mask.shape[-1] > context_len:
+                mask = mask[:context_len, :context_len]
+            attn_weights += mask
         attn_weights = SoftmaxFunction.forward(ctx, attn_weights, dim=-1)
         attn_weights = DropoutFunction.forward(ctx, attn_weights, dropout, dropout > 0)
         y = attn_weights @ v
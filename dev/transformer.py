@@ -1,7 +1,7 @@
 """transformer neural network module"""
 
 import math
-from typing import Literal, Optional
+from typing import Iterator, Literal, Optional
 
 from compyute.nn.modules.activations import ReLU
 from compyute.nn.modules.embeddings import Embedding
@@ -9,11 +9,13 @@ from compyute.nn.modules.linear import Linear
 from compyute.nn.modules.module import Module, ModuleList
 from compyute.nn.modules.normalizations import LayerNorm
 from compyute.nn.modules.regularizations import Dropout
-from compyute.nn.parameter import Buffer
+from compyute.nn.parameter import Buffer, Parameter
 from compyute.nn.utils.initializers import init_normal
-from compyute.tensor_ops.creation_ops import arange, empty, zeros
+from compyute.tensor_ops.creation_ops import arange, empty
+from compyute.tensor_ops.shape_ops import stack
 from compyute.tensor_ops.unary_ops import cos, exp, sin
 from compyute.tensors import Tensor
+from compyute.typing import float32
 from mha_parallel import ParallelMHA
 from mha_semiparallel import SemiparallelMHA
 from mha_sequential import SequentialMHA
@@ -61,6 +63,11 @@ class Transformer(Module):
         self.lm_head = Linear(embed_dim, n_embeds, bias)
         self.lm_head.w = self.token_emb.w  # weight sharing
 
+    def get_parameters(self, recursive: bool = True) -> Iterator[Parameter]:
+        # token embedding and lm head share their weights, only yield them once
+        params = {id(p): p for p in super().get_parameters(recursive)}
+        yield from params.values()
+
     @Module.register_forward
     def forward(self, x: Tensor) -> Tensor:
         x = self.token_emb(x) + self.pos_emb(x)
@@ -161,14 +168,13 @@ class PositionalEncoding(Module):
         self.max_seq_len = max_seq_len
         self.embedding_dim = embedding_dim
 
-        # compute positional encodings
-        encodings = zeros((max_seq_len, embedding_dim))
-        positions = arange(max_seq_len).view((max_seq_len, 1))
-        emb_range = arange(embedding_dim, step=2)
+        # compute positional encodings, interleave sin and cos along the last dim
+        positions = arange(max_seq_len, dtype=float32).view((max_seq_len, 1))
+        emb_range = arange(embedding_dim, step=2, dtype=float32)
         div_term = exp(emb_range * (-(math.log(base) / embedding_dim)))
-        encodings[:, 0::2] = sin(positions * div_term)
-        encodings[:, 1::2] = cos(positions * div_term)
-        self.encodings = Buffer(encodings)
+        angles = positions * div_term
+        encodings = stack([sin(angles), cos(angles)], dim=-1)
+        self.encodings = Buffer(encodings.view((max_seq_len, embedding_dim)))
 
     @Module.register_forward
     def forward(self, x: Tensor) -> Tensor:
@@ -36,18 +36,9 @@ def main() -> None:
 
     # prepare data
     data_enc_t = cp.tensor(data_enc, dtype=cp.int32)
-    X_train = cp.stack(
-        [
-            data_enc_t[i * context_length : i * context_length + context_length]
-            for i in range(len(data_enc_t) // context_length)
-        ]
-    )
-    y_train = cp.stack(
-        [
-            data_enc_t[i * context_length + 1 : i * context_length + context_length + 1]
-            for i in range(len(data_enc_t) // context_length)
-        ]
-    )
+    n_seqs = (len(data_enc_t) - 1) // context_length  # targets are shifted by one
+    X_train = data_enc_t[: n_seqs * context_length].view((n_seqs, context_length))
+    y_train = data_enc_t[1 : n_seqs * context_length + 1].view((n_seqs, context_length))
 
     # create model
     mask = get_causal_mask(context_length)
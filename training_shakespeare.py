@@ -1,16 +1,70 @@
 import os
+import threading
+from collections.abc import Iterable, Iterator
 from datetime import datetime
+from queue import Queue
+from typing import Any, Optional, TypeVar
 
 import compyute as cp
+import numpy as np
 import requests
 from compyute import nn
 from compyute.nn.utils.tensorboard import SummaryWriter
+from compyute.tensor_ops.reduction_ops import tensorsum
+from compyute.tensors import Tensor
 from simple_tokenizers import CharacterTokenizer
 
-from transformer.attention_utils import get_causal_mask
 from transformer.gpt import GPTTransformer
 
 
+def encode_chars(text: str, ivocab: dict[str, int]) -> np.ndarray:
+    """Encodes a text using a lookup table indexed by unicode code points."""
+    # -1 marks unknown characters, the extra last entry catches larger code points
+    lut = np.full(max(map(ord, ivocab)) + 2, -1, dtype=np.int32)
+    for c, i in ivocab.items():
+        lut[ord(c)] = i
+    code_points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    codes = lut[np.minimum(code_points, len(lut) - 1)]
+    unknown = np.flatnonzero(codes < 0)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown character {text[unknown[0]]!r}.")
+    return codes
+
+
+def copy_to_cpu(state: Any) -> Any:
+    """Recursively copies all tensors of a state dict to the CPU."""
+    if isinstance(state, Tensor):
+        return state.copy() if state.device == cp.cpu else state.to_cpu()
+    if isinstance(state, dict):
+        return {k: copy_to_cpu(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(copy_to_cpu(v) for v in state)
+    return state
+
+
+T = TypeVar("T")
+
+
+def prefetch(batches: Iterable[T], buffer_size: int = 2) -> Iterator[T]:
+    """Loads batches in a background thread while the current one is processed."""
+    queue: Queue = Queue(buffer_size)
+    end = object()
+
+    def load() -> None:
+        try:
+            for batch in batches:
+                queue.put(batch)
+        except Exception as e:
+            queue.put(e)
+        queue.put(end)
+
+    threading.Thread(target=load, daemon=True).start()
+    while (batch := queue.get()) is not end:
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
+
+
 def main() -> None:
     cp.random.set_seed(1337)
     device = cp.cuda
@@ -27,7 +81,9 @@ def main() -> None:
     step = 1
     max_steps = 10000
     label = "transformer_shakespeare_7"
+    log_interval = 10
     val_interval = 250
+    val_batch_size = 4 * batch_size  # fewer, larger batches without a backward pass
     checkpoint_interal = 500
 
     # load data
@@ -42,29 +98,16 @@ def main() -> None:
     tokenizer.ivocab = {c: i for i, c in enumerate(chars)}
 
     # prepare data
-    data_enc = cp.tensor(tokenizer.encode(data), dtype=cp.int32)
-    X = cp.stack(
-        [
-            data_enc[i * context_length : i * context_length + context_length]
-            for i in range(len(data_enc) // context_length)
-        ]
-    )
-    y = cp.stack(
-        [
-            data_enc[i * context_length + 1 : i * context_length + context_length + 1]
-            for i in range(len(data_enc) // context_length)
-        ]
-    )
+    data_enc = cp.tensor(encode_chars(data, tokenizer.ivocab), dtype=cp.int32)
+    n_seqs = (len(data_enc) - 1) // context_length  # targets are shifted by one
+    X = data_enc[: n_seqs * context_length].view((n_seqs, context_length))
+    y = data_enc[1 : n_seqs * context_length + 1].view((n_seqs, context_length))
 
     n = int(len(X) * 0.9)
-    X_train = X.to_int()[:n]
-    y_train = y.to_int()[:n]
-    X_val = X.to_int()[n:]
-    y_val = y.to_int()[n:]
+    X_train, y_train = X[:n], y[:n]
+    X_val, y_val = X[n:], y[n:]
 
     # create model
-    mask = get_causal_mask(context_length)
-
     model = GPTTransformer(
         n_embeds=tokenizer.vocab_size,
         embed_dim=embed_dims,
@@ -72,14 +115,14 @@ def main() -> None:
         n_heads=n_heads,
         n_blocks=n_blocks,
         max_context_len=context_length,
-        mask=mask,
         dropout=dropout,
+        is_causal=True,
     )
     model.to_device(device)
 
     # training
     train_dl = nn.utils.Dataloader((X_train, y_train), batch_size, device)
-    val_dl = nn.utils.Dataloader((X_val, y_val), batch_size, device, False)
+    val_dl = nn.utils.Dataloader((X_val, y_val), val_batch_size, device, False)
     loss_fn = nn.CrossEntropyLoss()
     optim = nn.optimizers.AdamW(model.get_parameters(), lr=3e-4)
 
@@ -98,45 +141,59 @@ def main() -> None:
     writer = SummaryWriter(log_dir=logdir)
 
     model.training()
+    train_losses = []
+    checkpoint_thread: Optional[threading.Thread] = None
     while step < max_steps:
 
-        for x, y in train_dl():
+        for x, y in prefetch(train_dl()):
 
             # training
             y_pred = model(x)
-            loss = loss_fn(y_pred, y).item()
+            train_losses.append(loss_fn(y_pred, y))  # keep on device, avoid sync
             loss_grads = loss_fn.backward()
             model.backward(loss_grads)
 
             optim.step()
             optim.reset_grads()
-            writer.add_scalar("train/loss", loss, step)
+
+            if step % log_interval == 0:
+                train_loss = tensorsum(train_losses).item() / len(train_losses)
+                writer.add_scalar("train/loss", train_loss, step)
+                train_losses = []
 
             # validation
             if step > 1 and step % val_interval == 0:
                 model.inference()
-                val_loss = 0.0
-                for x_val, y_val in val_dl():
-                    y_pred = model(x_val)
-                    val_loss += loss_fn(y_pred, y_val).item()
-                val_loss /= len(val_dl)
+                val_losses = [
+                    loss_fn(model(x_val), y_val)
+                    for x_val, y_val in prefetch(val_dl())
+                ]
+                val_loss = tensorsum(val_losses).item() / len(val_dl)
                 writer.add_scalar("val/loss", val_loss, step)
 
                 model.training()
 
-            # save checkpoints
+            # save checkpoints in the background from a snapshot of the state
             if step > 1 and step % checkpoint_interal == 0:
+                if checkpoint_thread is not None:
+                    checkpoint_thread.join()
                 model_state = model.get_state_dict()
                 optim_state = optim.get_state_dict()
-                state_dict = {"model": model_state, "optim": optim_state}
+                state_dict = copy_to_cpu({"model": model_state, "optim": optim_state})
                 checkpoint_name = f"{label}_{step}.cp"
-                cp.save(state_dict, checkpoint_name)
+                checkpoint_thread = threading.Thread(
+                    target=cp.save, args=(state_dict, checkpoint_name)
+                )
+                checkpoint_thread.start()
 
             if step == max_steps:
                 break
             step += 1
             print(f"{step=}", end="\r")
 
+    if checkpoint_thread is not None:
+        checkpoint_thread.join()
+
 
 if __name__ == "__main__":
     main()
@@ -51,6 +51,12 @@ class MultiHeadSelfAttention(Module):
         Whether to use bias values in the input projection. Defaults to ``False``.
     bias : bool, optional
         Whether to use bias values in the output projection. Defaults to ``True``.
+    flash : bool, optional
+        Whether to compute attention block-wise without materializing the attention
+        weights. Attention weights are not retained in this case. Defaults to ``False``.
+    is_causal : bool, optional
+        Whether to apply a causal mask in addition to ``mask``. No mask tensor has to be
+        stored by the module in this case. Defaults to ``False``.
     label: str, optional
         Module label. Defaults to ``None``. If `None`, the class name is used.
 
@@ -69,6 +75,8 @@ class MultiHeadSelfAttention(Module):
         out_scale: float = 1.0,
         attn_bias: bool = False,
         bias: bool = True,
+        flash: bool = False,
+        is_causal: bool = False,
         label: Optional[str] = None,
     ) -> None:
         if in_channels % n_heads != 0:
@@ -76,8 +84,11 @@ class MultiHeadSelfAttention(Module):
         super().__init__(label)
 
         self.n_heads = n_heads
-        self.mask = None if not mask else Buffer(mask)
+        # reuse a buffer shared across blocks instead of wrapping it again
+        self.mask = mask if mask is None or isinstance(mask, Buffer) else Buffer(mask)
         self.dropout = dropout
+        self.flash = flash
+        self.is_causal = is_causal
         self.attn_weights: Optional[Tensor] = None
 
         # init parameters
@@ -104,6 +115,8 @@ class MultiHeadSelfAttention(Module):
             self.mask,
             dropout,
             self.retain_values,
+            self.flash,
+            self.is_causal,
         )
         return y
 
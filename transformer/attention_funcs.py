@@ -1,15 +1,23 @@
 """attention functions"""
 
 import math
-from typing import Optional
+from typing import Iterator, Optional
 
+from compyute.backend import Device
 from compyute.nn.functional.activation_funcs import SoftmaxFunction
 from compyute.nn.functional.functions import Function, FunctionContext, PseudoContext
 from compyute.nn.functional.linear_funcs import LinearFunction
 from compyute.nn.functional.regularization_funcs import DropoutFunction
-from compyute.tensor_ops.shape_ops import concat, split
+from compyute.tensor_ops.creation_ops import empty, full, ones_like, zeros, zeros_like
+from compyute.tensor_ops.selection_ops import maximum
+from compyute.tensor_ops.unary_ops import exp, log
 from compyute.tensors import ShapeError, Tensor
 
+from .attention_utils import get_causal_mask
+
+_FLASH_BLOCK_SIZE = 64
+_MIN_SCORE = -1e30  # finite lower bound of the running maximum, avoids inf - inf
+
 
 class MultiHeadSelfAttentionFunction(Function):
     """Applies multi head self-attention to a tensor."""
@@ -26,24 +34,31 @@ class MultiHeadSelfAttentionFunction(Function):
         mask: Optional[Tensor],
         dropout: float,
         return_attn_weights: bool,
+        flash: bool,
+        is_causal: bool,
     ) -> tuple[Tensor, Optional[Tensor]]:
         if x.ndim < 3:
             raise ShapeError(f"Expected input to be 3D, got {x.ndim}D.")
 
         # input projection
         qkv = LinearFunction.forward(ctx, x, w_i, b_i)
-        q, k, v = split(qkv, splits=3, dim=-1)
 
-        # split into heads (B, T, H, Ch) and transpose to (B, H, T, Ch)
+        # split into q, k, v and heads (B, T, 3, H, Ch), transpose to (3, B, H, T, Ch)
         head_shape = (*x.shape[:2], n_heads, -1)
-        q = q.view(head_shape).transpose(1, 2).to_contiguous()
-        k = k.view(head_shape).transpose(1, 2).to_contiguous()
-        v = v.view(head_shape).transpose(1, 2).to_contiguous()
+        qkv = qkv.view((*x.shape[:2], 3, n_heads, -1))
+        qkv = qkv.transpose(1, 3).transpose(0, 2).transpose(1, 2).to_contiguous()
+        q, k, v = qkv[0], qkv[1], qkv[2]
 
         # multi head attention
-        attn, attn_weights = SDPAttentionFunction.forward(
-            ctx, q, k, v, mask, dropout, return_attn_weights
-        )
+        if flash:
+            attn = FlashAttentionFunction.forward(
+                ctx, q, k, v, mask, dropout, is_causal, _FLASH_BLOCK_SIZE
+            )
+            attn_weights = None
+        else:
+            attn, attn_weights = SDPAttentionFunction.forward(
+                ctx, q, k, v, mask, dropout, return_attn_weights, is_causal
+            )
 
         # transpose back to (B, T, H, Ch) and merge heads to (B, T, C)
         attn = attn.transpose(1, 2).view(x.shape)
@@ -51,14 +66,14 @@ class MultiHeadSelfAttentionFunction(Function):
         # output projection
         y = LinearFunction.forward(ctx, attn, w_o, b_o)
 
-        ctx.add(x.shape, head_shape)
+        ctx.add(x.shape, head_shape, flash)
         return y, attn_weights
 
     @staticmethod
     def backward(
         ctx: FunctionContext, dy: Tensor
     ) -> tuple[Tensor, Tensor, Optional[Tensor], Tensor, Optional[Tensor]]:
-        x_shape, head_shape = ctx.get()
+        x_shape, head_shape, flash = ctx.get()
 
         # output gradients
         dy, dw_o, db_o = LinearFunction.backward(ctx, dy)
@@ -67,16 +82,22 @@ class MultiHeadSelfAttentionFunction(Function):
         dy = dy.view(head_shape).transpose(1, 2).to_contiguous()
 
         # multi head attention gradients
-        dq, dk, dv = SDPAttentionFunction.backward(ctx, dy)
-
-        # transpose back to (B, T, H, Ch) and  merge head grads to (B, T, C)
-        dq = dq.transpose(1, 2).view(x_shape)
-        dk = dk.transpose(1, 2).view(x_shape)
-        dv = dv.transpose(1, 2).view(x_shape)
+        if flash:
+            dq, dk, dv = FlashAttentionFunction.backward(ctx, dy)
+        else:
+            dq, dk, dv = SDPAttentionFunction.backward(ctx, dy)
+
+        # transpose back to (B, T, H, Ch) and write into merged head grads (B, T, 3C)
+        batch_size, n_heads, context_len, head_size = dq.shape
+        dqkv_shape = (batch_size, context_len, 3, n_heads, head_size)
+        dqkv = empty(dqkv_shape, device=dy.device, dtype=dy.dtype)
+        dqkv[:, :, 0] = dq.transpose(1, 2)
+        dqkv[:, :, 1] = dk.transpose(1, 2)
+        dqkv[:, :, 2] = dv.transpose(1, 2)
+        dqkv = dqkv.view((*x_shape[:2], -1))
 
         # input projection gradients
-        dx = concat([dq, dk, dv])
-        dx, dw_i, db_i = LinearFunction.backward(ctx, dx)
+        dx, dw_i, db_i = LinearFunction.backward(ctx, dqkv)
 
         return dx, dw_i, db_i, dw_o, db_o
 
@@ -91,6 +112,8 @@ def multi_head_self_attention(
     mask: Optional[Tensor] = None,
     dropout: float = 0.0,
     return_attn_weights: bool = False,
+    flash: bool = False,
+    is_causal: bool = False,
 ) -> tuple[Tensor, Optional[Tensor]]:
     r"""Applies multi head attention to a tensor.
 
@@ -115,6 +138,11 @@ def multi_head_self_attention(
         Dropout probability of attention weights. Defaults to ``0``.
     return_attn_weights : bool, optional
         Whether to also return the computed attention weights. Defaults to ``False``.
+    flash : bool, optional
+        Whether to compute attention block-wise using :func:`flash_attention`.
+        Attention weights are not returned in this case. Defaults to ``False``.
+    is_causal : bool, optional
+        Whether to apply a causal mask in addition to ``mask``. Defaults to ``False``.
 
     Returns
     -------
@@ -138,6 +166,8 @@ def multi_head_self_attention(
         mask,
         dropout,
         return_attn_weights,
+        flash,
+        is_causal,
     )
 
 
@@ -153,6 +183,7 @@ class SDPAttentionFunction(Function):
         mask: Optional[Tensor],
         dropout: float,
         return_attn_weights: bool,
+        is_causal: bool,
     ) -> tuple[Tensor, Optional[Tensor]]:
         if q.ndim < 2:
             raise ShapeError(f"Expected query to be at least 2D, got {q.ndim}D.")
@@ -161,30 +192,35 @@ class SDPAttentionFunction(Function):
         if v.ndim < 2:
             raise ShapeError(f"Expected value to be at least 2D, got {v.ndim}D.")
         *_, context_len, head_size = q.shape
+        scale = 1.0 / math.sqrt(head_size)
 
-        attn_weights = q @ k.T / math.sqrt(head_size)
+        # scale queries (T, Ch) instead of attention scores (T, T)
+        q = q * scale
+        attn_weights = q @ k.T
         if context_len > 1 and mask is not None:
-            attn_weights += mask[:context_len, :context_len]
+            attn_weights += _get_mask(mask, context_len)
+        if is_causal:
+            attn_weights += _get_causal_mask(context_len, k.shape[-2], q.device)
         attn_weights = SoftmaxFunction.forward(ctx, attn_weights, dim=-1)
-        attn_weights = DropoutFunction.forward(ctx, attn_weights, dropout, dropout > 0)
+        if dropout > 0:
+            attn_weights = DropoutFunction.forward(ctx, attn_weights, dropout, True)
         y = attn_weights @ v
 
-        ctx.add(q, k, v, attn_weights)
+        ctx.add(q, k, v, attn_weights, scale, dropout)
         return y, (None if not return_attn_weights else attn_weights)
 
     @staticmethod
     def backward(ctx: FunctionContext, dy: Tensor) -> tuple[Tensor, Tensor, Tensor]:
-        q, k, v, attn_weights = ctx.get()
-        head_size = q.shape[-1]
+        q, k, v, attn_weights, scale, dropout = ctx.get()
 
         # attention gradients
         dattn_weights = dy @ v.T
-        dattn_weights = DropoutFunction.backward(ctx, dattn_weights)
+        if dropout > 0:
+            dattn_weights = DropoutFunction.backward(ctx, dattn_weights)
         dattn_weights = SoftmaxFunction.backward(ctx, dattn_weights)
-        dattn_weights /= math.sqrt(head_size)
 
-        # query, key, value gradients
-        dq = dattn_weights @ k
+        # query, key, value gradients (q is already scaled)
+        dq = dattn_weights @ k * scale
         dk = dattn_weights.T @ q
         dv = attn_weights.T @ dy
 
@@ -198,6 +234,7 @@ def sdp_attention(
     mask: Optional[Tensor] = None,
     dropout: float = 0.0,
     return_attn_weights: bool = False,
+    is_causal: bool = False,
 ) -> tuple[Tensor, Optional[Tensor]]:
     r"""Computes the scaled dot product attention scores.
 
@@ -216,6 +253,9 @@ def sdp_attention(
         Dropout probability of attention weights. Defaults to ``0``.
     return_attn_weights : bool, optional
         Whether to also return the computed attention weights. Defaults to ``False``.
+    is_causal : bool, optional
+        Whether to apply a causal mask in addition to ``mask``. Query ``i`` attends
+        to keys ``j <= i``, also if query and key lengths differ. Defaults to ``False``.
 
     Returns
     -------
@@ -229,5 +269,218 @@ def sdp_attention(
     :class:`compyute.nn.MultiHeadAttention`
     """
     return SDPAttentionFunction.forward(
-        PseudoContext(), q, k, v, mask, dropout, return_attn_weights
+        PseudoContext(), q, k, v, mask, dropout, return_attn_weights, is_causal
+    )
+
+
+class FlashAttentionFunction(Function):
+    """Computes the scaled dot product attention scores block-wise using an online
+    softmax without materializing the full attention weights."""
+
+    @staticmethod
+    def forward(
+        ctx: FunctionContext,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        mask: Optional[Tensor],
+        dropout: float,
+        is_causal: bool,
+        block_size: int,
+    ) -> Tensor:
+        if q.ndim < 2:
+            raise ShapeError(f"Expected query to be at least 2D, got {q.ndim}D.")
+        if k.ndim < 2:
+            raise ShapeError(f"Expected key to be at least 2D, got {k.ndim}D.")
+        if v.ndim < 2:
+            raise ShapeError(f"Expected value to be at least 2D, got {v.ndim}D.")
+        scale = 1.0 / math.sqrt(q.shape[-1])
+        q = q * scale  # scale queries once instead of every block of scores
+
+        y = zeros_like(q)
+        lse = zeros((*q.shape[:-1], 1), device=q.device, dtype=q.dtype)
+        dropout_maps = []
+
+        for q_start, q_stop, k_blocks in _get_attn_blocks(q, k, is_causal, block_size):
+            q_i = q[..., q_start:q_stop, :]
+            row_shape = (*q_i.shape[:-1], 1)
+
+            # running row maximum, row sum and output of the online softmax
+            m_i = full(row_shape, _MIN_SCORE, device=q.device, dtype=q.dtype)
+            l_i = zeros(row_shape, device=q.device, dtype=q.dtype)
+            y_i = zeros_like(q_i)
+
+            for k_start, k_stop in k_blocks:
+                k_j = k[..., k_start:k_stop, :]
+                s_ij = _get_attn_scores(q_i, k_j, q_start, k_start, mask, is_causal)
+                m_ij = maximum(m_i, s_ij.max(-1, keepdims=True))
+                p_ij = exp(s_ij - m_ij)
+                alpha = exp(m_i - m_ij)
+                l_i = alpha * l_i + p_ij.sum(-1, keepdims=True)
+                if dropout > 0:
+                    dropout_map = _get_dropout_map(p_ij, dropout)
+                    dropout_maps.append(dropout_map)
+                    p_ij *= dropout_map
+                y_i = alpha * y_i + p_ij @ v[..., k_start:k_stop, :]
+                m_i = m_ij
+
+            y[..., q_start:q_stop, :] = y_i / l_i
+            lse[..., q_start:q_stop, :] = m_i + log(l_i)
+
+        ctx.add(
+            q, k, v, mask, dropout, is_causal, block_size, scale, y, lse, dropout_maps
+        )
+        return y
+
+    @staticmethod
+    def backward(ctx: FunctionContext, dy: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+        q, k, v, mask, dropout, is_causal, block_size, scale, y, lse, dropout_maps = (
+            ctx.get()
+        )
+        dropout_maps = iter(dropout_maps)
+
+        dq, dk, dv = zeros_like(q), zeros_like(k), zeros_like(v)
+        d = (dy * y).sum(-1, keepdims=True)
+
+        for q_start, q_stop, k_blocks in _get_attn_blocks(q, k, is_causal, block_size):
+            q_i = q[..., q_start:q_stop, :]
+            dy_i = dy[..., q_start:q_stop, :]
+            lse_i = lse[..., q_start:q_stop, :]
+            d_i = d[..., q_start:q_stop, :]
+            dq_i = zeros_like(q_i)
+
+            for k_start, k_stop in k_blocks:
+                k_j = k[..., k_start:k_stop, :]
+                v_j = v[..., k_start:k_stop, :]
+
+                # recompute attention weights of the block
+                s_ij = _get_attn_scores(q_i, k_j, q_start, k_start, mask, is_causal)
+                p_ij = exp(s_ij - lse_i)
+                dp_ij = dy_i @ v_j.T
+                if dropout > 0:
+                    dropout_map = next(dropout_maps)
+                    dv[..., k_start:k_stop, :] += (p_ij * dropout_map).T @ dy_i
+                    dp_ij *= dropout_map
+                else:
+                    dv[..., k_start:k_stop, :] += p_ij.T @ dy_i
+
+                # softmax gradients (q is already scaled)
+                ds_ij = p_ij * (dp_ij - d_i)
+                dq_i += ds_ij @ k_j
+                dk[..., k_start:k_stop, :] += ds_ij.T @ q_i
+
+            dq[..., q_start:q_stop, :] = dq_i * scale
+
+        return dq, dk, dv
+
+
+def flash_attention(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Tensor] = None,
+    dropout: float = 0.0,
+    is_causal: bool = False,
+    block_size: int = _FLASH_BLOCK_SIZE,
+) -> Tensor:
+    r"""Computes the scaled dot product attention scores block-wise following
+    `Dao, 2023 <https://arxiv.org/pdf/2307.08691>`_.
+
+    Parameters
+    ----------
+    q : Tensor
+        Query tensor.
+    k : Tensor
+        Key tensor.
+    v : Tensor
+        Value tensor.
+    mask : Tensor, optional
+        Attention-mask. Defaults to ``None``.
+        Must be a zeros-tensor with values of ```-inf`` indicating elements to be masked out.
+    dropout : float, optional
+        Dropout probability of attention weights. Defaults to ``0``.
+    is_causal : bool, optional
+        Whether to apply a causal mask. Query ``i`` attends to keys ``j <= i``, also
+        if query and key lengths differ. Blocks above the diagonal are skipped.
+        Defaults to ``False``.
+    block_size : int, optional
+        Number of queries and keys processed per block. Defaults to ``64``.
+
+    Returns
+    -------
+    Tensor
+        Output tensor.
+
+
+    .. note::
+        Only the row-wise log-sum-exp of the attention scores is kept for the backward
+        pass, attention weights are recomputed block-wise. If ``dropout > 0``, the
+        dropout maps of each block are kept as well.
+
+    .. note::
+        This function is meant to reduce peak memory, not to be faster. Without fused
+        kernels, each block runs as separate operations, so it is expected to be
+        slower than :func:`sdp_attention`. With ``dropout > 0``, the kept dropout maps
+        are as large as the attention weights, so memory is only saved without dropout.
+
+    See Also
+    ----------
+    :func:`sdp_attention`
+    """
+    return FlashAttentionFunction.forward(
+        PseudoContext(), q, k, v, mask, dropout, is_causal, block_size
     )
+
+
+def _get_attn_blocks(
+    q: Tensor, k: Tensor, is_causal: bool, block_size: int
+) -> Iterator[tuple[int, int, list[tuple[int, int]]]]:
+    q_len, k_len = q.shape[-2], k.shape[-2]
+    for q_start in range(0, q_len, block_size):
+        q_stop = min(q_start + block_size, q_len)
+        k_len_i = min(q_stop, k_len) if is_causal else k_len  # skip blocks above diag
+        k_blocks = [
+            (k_start, min(k_start + block_size, k_len_i))
+            for k_start in range(0, k_len_i, block_size)
+        ]
+        yield q_start, q_stop, k_blocks
+
+
+def _get_attn_scores(
+    q_i: Tensor,
+    k_j: Tensor,
+    q_start: int,
+    k_start: int,
+    mask: Optional[Tensor],
+    is_causal: bool,
+) -> Tensor:
+    q_stop, k_stop = q_start + q_i.shape[-2], k_start + k_j.shape[-2]
+    s_ij = q_i @ k_j.T
+    if mask is not None:
+        s_ij += mask[q_start:q_stop, k_start:k_stop]
+    if is_causal and k_stop - 1 > q_start:  # block crosses the diagonal
+        s_ij += _get_causal_mask(q_stop, k_stop, s_ij.device)[q_start:, k_start:]
+    return s_ij
+
+
+def _get_mask(mask: Tensor, context_len: int) -> Tensor:
+    if mask.shape[-1] == context_len:
+        return mask  # avoid slicing if the sequence spans the entire mask
+    return mask[:context_len, :context_len]
+
+
+_causal_masks: dict[Device, Tensor] = {}  # shared by all attention layers
+
+
+def _get_causal_mask(q_len: int, k_len: int, device: Device) -> Tensor:
+    mask = _causal_masks.get(device)
+    max_len = max(q_len, k_len)
+    if mask is None or mask.shape[-1] < max_len:
+        mask = _causal_masks[device] = get_causal_mask(max_len).to_device(device)
+    if mask.shape[-1] == q_len == k_len:
+        return mask  # avoid slicing if the sequence spans the entire mask
+    return mask[:q_len, :k_len]
+
+
+def _get_dropout_map(x: Tensor, dropout: float) -> Tensor:
+    return DropoutFunction.forward(PseudoContext(), ones_like(x), dropout, True)
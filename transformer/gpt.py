@@ -1,19 +1,19 @@
 """transformer neural network module"""
 
 import math
-from typing import Optional
+from typing import Iterator, Optional
 
+from compyute.backend import Device
 from compyute.nn.modules.activations import GELU
 from compyute.nn.modules.embeddings import Embedding
 from compyute.nn.modules.linear import Linear
 from compyute.nn.modules.module import Module, ModuleList
 from compyute.nn.modules.normalizations import LayerNorm
 from compyute.nn.modules.regularizations import Dropout
-from compyute.nn.parameter import Buffer
+from compyute.nn.parameter import Buffer, Parameter
 from compyute.nn.utils.initializers import init_normal
-from compyute.tensor_ops.creation_ops import arange, empty
+from compyute.tensor_ops.creation_ops import empty, zeros_like
 from compyute.tensors import Tensor
-from compyute.typing import int32
 
 from .attention import MultiHeadSelfAttention
 
@@ -49,6 +49,11 @@ class GPTTransformer(Module):
         Must be a zeros-tensor with values of ```-inf`` indicating elements to be masked out.
     dropout : float, optional
         Dropout probability. Defaults to ``0.0``.
+    flash : bool, optional
+        Whether to compute attention block-wise without materializing the attention
+        weights. Defaults to ``False``.
+    is_causal : bool, optional
+        Whether to apply a causal mask in addition to ``mask``. Defaults to ``False``.
     label: str, optional
         Module label. Defaults to ``None``. If `None`, the class name is used.
 
@@ -79,6 +84,8 @@ class GPTTransformer(Module):
         max_context_len: int,
         mask: Optional[Tensor] = None,
         dropout: float = 0.0,
+        flash: bool = False,
+        is_causal: bool = False,
         label: Optional[str] = None,
     ) -> None:
         super().__init__(label)
@@ -90,6 +97,7 @@ class GPTTransformer(Module):
         init_normal(self.token_emb.w, self.pos_emb.w, std=std)
 
         # Transformer blocks
+        mask = None if mask is None else Buffer(mask)  # shared by all blocks
         out_scale = 1 / math.sqrt(2 * n_blocks)
         self.blocks = ModuleList(
             TransformerBlock(
@@ -99,6 +107,8 @@ class GPTTransformer(Module):
                 out_scale,
                 mask,
                 dropout,
+                flash,
+                is_causal,
             )
             for _ in range(n_blocks)
         )
@@ -108,11 +118,27 @@ class GPTTransformer(Module):
         self.lm_head = Linear(embed_dim, n_embeds, bias=False)
         self.lm_head.w = self.token_emb.w  # weight sharing
 
-        self.pos = Buffer(arange(max_context_len, dtype=int32).view((1, -1)))
+    def get_parameters(self, recursive: bool = True) -> Iterator[Parameter]:
+        # token embedding and lm head share their weights, only yield them once
+        params = {id(p): p for p in super().get_parameters(recursive)}
+        yield from params.values()
+
+    def load_state_dict(
+        self, state_dict: dict[str, Tensor], target_device: Optional[Device] = None
+    ) -> None:
+        # checkpoints of earlier versions contain position indices and mask buffers
+        keys = self.get_state_dict().keys()
+        state_dict = {
+            k: v
+            for k, v in state_dict.items()
+            if k in keys or k.split(".")[-1] not in ("pos", "mask")
+        }
+        super().load_state_dict(state_dict, target_device)
 
     @Module.register_forward
     def forward(self, x: Tensor) -> Tensor:
-        x = self.token_emb(x) + self.pos_emb(self.pos[:, : x.shape[-1]])
+        # positions are contiguous, so the embedding lookup is a slice of the weights
+        x = self.token_emb(x) + self.pos_emb.w[: x.shape[-1]]
         for block in self.blocks:
             x = block(x)
         x = self.lm_head(self.ln(x))
@@ -124,7 +150,12 @@ class GPTTransformer(Module):
         for module in reversed(self.blocks):
             dy = module.backward(dy)
         self.token_emb.backward(dy)
-        self.pos_emb.backward(dy.sum(0))
+        dpos_emb_w = dy.sum(0)
+        if len(dpos_emb_w) < len(self.pos_emb.w):  # pad grads of unused positions
+            dpos_emb_w_padded = zeros_like(self.pos_emb.w)
+            dpos_emb_w_padded[: len(dpos_emb_w)] = dpos_emb_w
+            dpos_emb_w = dpos_emb_w_padded
+        self.pos_emb.update_parameter_grad(self.pos_emb.w, dpos_emb_w)
         return empty((0,))
 
 
@@ -138,12 +169,21 @@ class TransformerBlock(Module):
         out_scale: float,
         mask: Optional[Tensor],
         dropout: float,
+        flash: bool,
+        is_causal: bool,
     ) -> None:
         super().__init__()
 
         self.ln1 = LayerNorm((embed_dim,))
         self.attn = MultiHeadSelfAttention(
-            embed_dim, n_heads, mask, dropout, out_scale, True
+            embed_dim,
+            n_heads,
+            mask,
+            dropout,
+            out_scale,
+            True,
+            flash=flash,
+            is_causal=is_causal,
         )
         self.dropout1 = Dropout(dropout)
 
@@ -160,7 +200,7 @@ class TransformerBlock(Module):
     @Module.register_backward
     def backward(self, dy: Tensor) -> Tensor:
         dy = dy + self.ln2.backward(self.mlp.backward(self.dropout2.backward(dy)))
-        dy = dy + self.ln1.backward(self.attn.backward(self.dropout1.backward(dy)))
+        dy += self.ln1.backward(self.attn.backward(self.dropout1.backward(dy)))
         return dy
 
 
@@ -1,7 +1,7 @@
 """transformer neural network module"""
 
 import math
-from typing import Optional
+from typing import Iterator, Optional
 
 from compyute.nn.modules.activations import ReLU
 from compyute.nn.modules.embeddings import Embedding
@@ -9,11 +9,13 @@ from compyute.nn.modules.linear import Linear
 from compyute.nn.modules.module import Module, ModuleList
 from compyute.nn.modules.normalizations import LayerNorm
 from compyute.nn.modules.regularizations import Dropout
-from compyute.nn.parameter import Buffer
+from compyute.nn.parameter import Buffer, Parameter
 from compyute.nn.utils.initializers import init_normal
-from compyute.tensor_ops.creation_ops import arange, empty, zeros
+from compyute.tensor_ops.creation_ops import arange, empty
+from compyute.tensor_ops.shape_ops import stack
 from compyute.tensor_ops.unary_ops import cos, exp, sin
 from compyute.tensors import Tensor
+from compyute.typing import float32
 
 from .attention import MultiHeadSelfAttention
 
@@ -93,6 +95,7 @@ class VaswaniTransformer(Module):
         self.emb_dropout = Dropout(dropout)
 
         # Transformer blocks
+        mask = None if mask is None else Buffer(mask)  # shared by all blocks
         self.blocks = ModuleList(
             TransformerBlock(embed_dim, mlp_channels, n_heads, mask, dropout)
             for _ in range(n_blocks)
@@ -102,6 +105,11 @@ class VaswaniTransformer(Module):
         self.lm_head = Linear(embed_dim, n_embeds)
         self.lm_head.w = self.token_emb.w  # weight sharing
 
+    def get_parameters(self, recursive: bool = True) -> Iterator[Parameter]:
+        # token embedding and lm head share their weights, only yield them once
+        params = {id(p): p for p in super().get_parameters(recursive)}
+        yield from params.values()
+
     @Module.register_forward
     def forward(self, x: Tensor) -> Tensor:
         x = self.token_emb(x) + self.pos_emb(x)
@@ -148,9 +156,9 @@ class TransformerBlock(Module):
     @Module.register_backward
     def backward(self, dy: Tensor) -> Tensor:
         dy = self.ln2.backward(dy)
-        dy = dy + self.mlp.backward(self.dropout2.backward(dy))
+        dy += self.mlp.backward(self.dropout2.backward(dy))
         dy = self.ln1.backward(dy)
-        dy = dy + self.attn.backward(self.dropout1.backward(dy))
+        dy += self.attn.backward(self.dropout1.backward(dy))
         return dy
 
 
@@ -220,14 +228,13 @@ class PositionalEncoding(Module):
         self.max_seq_len = max_seq_len
         self.embedding_dim = embedding_dim
 
-        # compute positional encodings
-        encodings = zeros((max_seq_len, embedding_dim))
-        positions = arange(max_seq_len).view((max_seq_len, 1))
-        emb_range = arange(embedding_dim, step=2)
+        # compute positional encodings, interleave sin and cos along the last dim
+        positions = arange(max_seq_len, dtype=float32).view((max_seq_len, 1))
+        emb_range = arange(embedding_dim, step=2, dtype=float32)
         div_term = exp(emb_range * (-(math.log(base) / embedding_dim)))
-        encodings[:, 0::2] = sin(positions * div_term)
-        encodings[:, 1::2] = cos(positions * div_term)
-        self.encodings = Buffer(encodings)
+        angles = positions * div_term
+        encodings = stack([sin(angles), cos(angles)], dim=-1)
+        self.encodings = Buffer(encodings.view((max_seq_len, embedding_dim)))
 
     @Module.register_forward
     def forward(self, x: Tensor) -> Tensor:
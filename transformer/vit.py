@@ -3,6 +3,7 @@
 import math
 from typing import Optional
 
+from compyute.backend import Device
 from compyute.nn.modules.activations import GELU
 from compyute.nn.modules.convolutions import Conv2D
 from compyute.nn.modules.embeddings import Embedding
@@ -10,12 +11,11 @@ from compyute.nn.modules.linear import Linear
 from compyute.nn.modules.module import Module, ModuleList
 from compyute.nn.modules.normalizations import LayerNorm
 from compyute.nn.modules.regularizations import Dropout
-from compyute.nn.parameter import Buffer, Parameter
+from compyute.nn.parameter import Parameter
 from compyute.nn.utils.initializers import init_normal
-from compyute.tensor_ops.creation_ops import arange, empty, zeros
+from compyute.tensor_ops.creation_ops import empty, zeros
 from compyute.tensor_ops.shape_ops import broadcast_to, concat, insert_dim
 from compyute.tensors import Tensor
-from compyute.typing import int32
 
 from .attention import MultiHeadSelfAttention
 
@@ -61,13 +61,18 @@ class VisionTransformer(Module):
         self.ln = LayerNorm((embed_dim,))
         self.head = Linear(embed_dim, n_classes)
 
-        self.pos = Buffer(arange(n_patches + 1, dtype=int32).view((1, -1)))
+    def load_state_dict(
+        self, state_dict: dict[str, Tensor], target_device: Optional[Device] = None
+    ) -> None:
+        # checkpoints of earlier versions contain the position indices
+        state_dict = {k: v for k, v in state_dict.items() if k != "pos"}
+        super().load_state_dict(state_dict, target_device)
 
     @Module.register_forward
     def forward(self, x: Tensor) -> Tensor:
         patch_emb = self.patch_emb(x)
         class_emb = broadcast_to(self.class_emb, (x.shape[0], 1, patch_emb.shape[-1]))
-        x = concat([class_emb, patch_emb], dim=1) + self.pos_emb(self.pos)
+        x = concat([class_emb, patch_emb], dim=1) + self.pos_emb.w  # all positions
         x = self.emb_dropout(x)
         for block in self.blocks:
             x = block(x)
@@ -79,7 +84,7 @@ class VisionTransformer(Module):
         for module in reversed(self.blocks):
             dy = module.backward(dy)
         dy = self.emb_dropout.backward(dy)
-        self.pos_emb.backward(dy.sum(0))
+        self.pos_emb.update_parameter_grad(self.pos_emb.w, dy.sum(0))
         self.class_emb.grad = dy[:, 0].sum(0, keepdims=True)
         self.patch_emb.backward(dy[:, 1:])
         return empty((0,))
@@ -109,7 +114,7 @@ class TransformerBlock(Module):
     @Module.register_backward
     def backward(self, dy: Tensor) -> Tensor:
         dy = dy + self.ln2.backward(self.mlp.backward(self.dropout2.backward(dy)))
-        dy = dy + self.ln1.backward(self.msa.backward(self.dropout1.backward(dy)))
+        dy += self.ln1.backward(self.msa.backward(self.dropout1.backward(dy)))
         return dy
 
 